@@ -1,7 +1,9 @@
 import azure.functions as func
-import json
 import logging
 import os
+import threading
+import orjson
+from cachetools import TTLCache
 from webhook_processor import WebhookProcessor
 
 # Initialize the function app
@@ -12,6 +14,19 @@ app = func.FunctionApp()
 development_mode = os.environ.get('DEVELOPMENT_MODE', '').lower() == 'true'
 webhook_processor = WebhookProcessor(development_mode=development_mode)
 
+# Storage queue that decouples webhook intake from processing
+WEBHOOK_QUEUE_NAME = 'github-webhooks'
+
+# Storage queue messages are capped at 64 KB after base64 encoding
+MAX_QUEUE_MESSAGE_BYTES = 48 * 1024
+
+# 200 responses for recently seen X-GitHub-Delivery ids, so redeliveries are answered
+# without parsing or queueing. Ignored events are recorded at intake; merges only
+# once the queue trigger has written them, as the queue output binding is committed
+# after intake returns and a failed enqueue must stay retryable by redelivery
+delivery_cache = TTLCache(maxsize=1024, ttl=3600)
+delivery_cache_lock = threading.Lock()
+
 @app.route(route="HelloWorld", auth_level=func.AuthLevel.ANONYMOUS)
 def hello_world(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
@@ -34,33 +49,70 @@ def hello_world(req: func.HttpRequest) -> func.HttpResponse:
         )
         
 @app.route(route="github-webhook", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
-def github_webhook(req: func.HttpRequest) -> func.HttpResponse:
+@app.queue_output(arg_name="msg", queue_name=WEBHOOK_QUEUE_NAME, connection="AzureWebJobsStorage")
+def github_webhook(req: func.HttpRequest, msg: func.Out[str]) -> func.HttpResponse:
     logging.info('GitHub webhook received')
     
+    delivery_id = req.headers.get('X-GitHub-Delivery')
+    if delivery_id:
+        with delivery_cache_lock:
+            cached = delivery_cache.get(delivery_id)
+        if cached:
+            logging.info('Duplicate delivery %s - returning cached response', delivery_id)
+            return func.HttpResponse(cached, status_code=200, mimetype="application/json")
+    
     try:
         # Get the webhook payload
-        payload = req.get_json()
+        body = req.get_body()
         logging.info('Webhook payload received')
         
-        # Process the webhook
-        file_path = webhook_processor.process_webhook(payload)
+        # Only merges to main/master are worth queueing
+        message = webhook_processor.encode_queue_message(body, delivery_id=delivery_id)
+        if message is None:
+            response_body = orjson.dumps({"message": "Webhook received but not processed (conditions not met)"})
+            if delivery_id:
+                with delivery_cache_lock:
+                    delivery_cache[delivery_id] = response_body
+            return func.HttpResponse(response_body, status_code=200, mimetype="application/json")
+        if len(message) > MAX_QUEUE_MESSAGE_BYTES:
+            logging.error('Queue message is %d bytes, over the %d byte limit', len(message), MAX_QUEUE_MESSAGE_BYTES)
+            return func.HttpResponse("Webhook payload too large to queue", status_code=413)
         
-        if file_path:
-            return func.HttpResponse(
-                json.dumps({"message": "Webhook received and saved successfully", "file": file_path}),
-                status_code=200,
-                mimetype="application/json"
-            )
-        else:
-            return func.HttpResponse(
-                json.dumps({"message": "Webhook received but not saved (conditions not met)"}),
-                status_code=200,
-                mimetype="application/json"
-            )
+        # Hand off to the queue trigger so GitHub/OpenAI calls don't block the response
+        msg.set(message.decode('utf-8'))
+        return func.HttpResponse(
+            orjson.dumps({"message": "Webhook accepted for processing"}),
+            status_code=202,
+            mimetype="application/json"
+        )
             
     except ValueError as e:
-        logging.error(f'Error parsing webhook payload: {str(e)}')
+        logging.error('Error parsing webhook payload: %s', e)
         return func.HttpResponse("Invalid JSON payload", status_code=400)
     except Exception as e:
-        logging.error(f'Error processing webhook: {str(e)}')
-        return func.HttpResponse("Error processing webhook", status_code=500)
\ No newline at end of file
+        logging.error('Error queueing webhook: %s', e)
+        return func.HttpResponse("Error processing webhook", status_code=500)
+
+@app.queue_trigger(arg_name="msg", queue_name=WEBHOOK_QUEUE_NAME, connection="AzureWebJobsStorage")
+def process_github_webhook(msg: func.QueueMessage) -> None:
+    logging.info('Processing queued GitHub webhook %s', msg.id)
+    
+    # Errors propagate so the runtime retries and eventually poisons the message;
+    # process_webhook only returns once this message's rows are written.
+    # The message holds only the payload fields processing needs (see encode_queue_message)
+    message = orjson.loads(msg.get_body())
+    
+    # A redelivered merge may be queued more than once; skip it once it has been written
+    delivery_id = message.get('delivery_id')
+    if delivery_id:
+        with delivery_cache_lock:
+            already_processed = delivery_id in delivery_cache
+        if already_processed:
+            logging.info('Delivery %s already processed - skipping', delivery_id)
+            return
+    
+    webhook_processor.process_queue_message(message)
+    
+    if delivery_id:
+        with delivery_cache_lock:
+            delivery_cache[delivery_id] = orjson.dumps({"message": "Webhook already processed"})
@@ -1,7 +1,39 @@
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import azure.functions as func
 import pytest
-from webhook_processor import WebhookProcessor
+import zstandard as zstd
+from postgrest import APIError
+import function_app
+import webhook_processor
+from webhook_processor import WebhookProcessor, _clean_description
+
+
+class FakeSupabaseClient:
+    """Records insert_pr_merge_with_models RPC calls instead of writing to Supabase"""
+    def __init__(self, failing_prs=()):
+        self.rpc_calls = []
+        self.failing_prs = set(failing_prs)
+        
+    def rpc(self, name, params):
+        self.rpc_calls.append((name, params))
+        return FakeRpcRequest(self, params)
+
+
+class FakeRpcRequest:
+    """Fails the write when it carries any of the client's failing PR numbers"""
+    def __init__(self, client, params):
+        self.client = client
+        self.params = params
+        
+    def execute(self):
+        if any(pr['pr_number'] in self.client.failing_prs for pr in self.params['pr']):
+            raise APIError({'message': 'insert failed'})
+        return None
+
 
 class TestWebhookProcessor:
     @pytest.fixture
@@ -16,6 +48,111 @@ class TestWebhookProcessor:
         with open(webhook_file) as f:
             return json.load(f)
             
+    @pytest.fixture
+    def sample_webhook_body(self) -> bytes:
+        """Load the raw bytes of the sample webhook payload"""
+        return Path("webhooks/webhook_payload_20251002_175804.json").read_bytes()
+        
+    @pytest.mark.parametrize('payload', [
+        {'action': 'closed', 'pull_request': {'merged': True, 'base': {'ref': 'main'}}},
+        {'action': 'closed', 'pull_request': {'merged': True, 'base': {'ref': 'master'}}},
+        {'action': 'closed', 'pull_request': {'merged': False, 'base': {'ref': 'main'}}},
+        {'action': 'closed', 'pull_request': {'merged': True, 'base': {'ref': 'develop'}}},
+        {'action': 'closed', 'pull_request': None},
+        {'action': 'opened', 'pull_request': {'merged': False, 'base': {'ref': 'main'}}},
+        {'zen': 'Keep it logically awesome.'},
+    ])
+    def test_encode_queue_message_matches_dict_check(self, processor: WebhookProcessor, payload):
+        """Test that intake queues exactly the events the parsed payload check accepts"""
+        message = processor.encode_queue_message(json.dumps(payload).encode())
+        if processor.is_merge_to_main(payload):
+            assert isinstance(message, bytes)
+        else:
+            assert message is None
+        
+    def test_encode_queue_message_invalid_json(self, processor: WebhookProcessor):
+        """Test that malformed bodies raise ValueError"""
+        with pytest.raises(ValueError):
+            processor.encode_queue_message(b'{"action": "closed"')
+        with pytest.raises(ValueError):
+            processor.encode_queue_message(b'{"action": 1}')
+            
+    def test_clean_description(self):
+        """Test that PR template noise is stripped before summarization"""
+        description = (
+            "<!-- Describe your change -->\n"
+            "## Summary\n"
+            "See [docs](https://example.com/docs) here.\n\n\n\n"
+            "- [x] Tests added\n"
+            "* [ ] Docs updated\n"
+            "Done\n"
+        )
+        assert _clean_description(description) == "## Summary\nSee docs here.\n\nDone"
+        
+        # Long descriptions are truncated
+        assert len(_clean_description("a" * 5000)) == 2000
+        
+    def test_saved_payload_round_trip(self, processor: WebhookProcessor, sample_webhook_body, tmp_path, monkeypatch):
+        """Test that a .json.zst payload file can be processed locally"""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(processor, 'fetch_pr_files', lambda owner, name, number: [])
+        
+        file_path = processor.save_webhook_payload(sample_webhook_body)
+        
+        assert file_path.endswith('.json.zst')
+        assert zstd.ZstdDecompressor().decompress(Path(file_path).read_bytes()) == sample_webhook_body
+        
+        result = processor.process_local_file(file_path)
+        expected = processor.process_webhook(json.loads(sample_webhook_body))
+        assert result is not None
+        assert result['pr_data'] == expected['pr_data']
+
+    def test_failed_payload_write_records_no_file(self, sample_webhook_body, tmp_path, monkeypatch):
+        """Test that a payload file path is only reported once the file was written"""
+        processor = WebhookProcessor(development_mode=True, save_payload=True)
+        monkeypatch.setattr(processor, 'fetch_pr_files', lambda owner, name, number: [])
+        
+        # A regular file where the webhooks directory should be makes the write fail
+        blocked_dir = tmp_path / 'webhooks'
+        blocked_dir.write_text('')
+        processor.webhooks_dir = blocked_dir
+        processor._webhook_prefix = str(blocked_dir / 'webhook_payload_')
+        
+        assert processor.save_webhook_payload(sample_webhook_body) is None
+        result = processor.process_webhook(json.loads(sample_webhook_body), raw_body=sample_webhook_body)
+        assert result['file_path'] is None
+
+    def test_close_does_not_leave_other_processors_with_closed_clients(self, monkeypatch):
+        """Test that closing one processor lets others rebuild the shared clients"""
+        monkeypatch.setattr(webhook_processor._CONFIG, 'openai_api_key', 'test-key')
+        webhook_processor.close_shared_clients()
+        first, second = WebhookProcessor(development_mode=True), WebhookProcessor(development_mode=True)
+        
+        client = second.openai_client
+        http_client = webhook_processor._get_http_client()
+        first.close()
+        
+        assert http_client.is_closed
+        assert second.openai_client is not client
+        assert webhook_processor._get_http_client() is not http_client
+        assert not webhook_processor._get_http_client().is_closed
+        webhook_processor.close_shared_clients()
+
+    def test_queued_merge_records_payload_saved_at_intake(self, sample_webhook_body, tmp_path, monkeypatch):
+        """Test that the full webhook body is saved at intake and not replaced by the queue message"""
+        monkeypatch.chdir(tmp_path)
+        processor = WebhookProcessor(development_mode=True, save_payload=True)
+        monkeypatch.setattr(processor, 'fetch_pr_files', lambda owner, name, number: [])
+        
+        message = processor.encode_queue_message(sample_webhook_body)
+        queued = json.loads(message)
+        result = processor.process_queue_message(queued)
+        
+        saved_files = list(Path('webhooks').iterdir())
+        assert [str(path) for path in saved_files] == [queued['payload_file']]
+        assert result['file_path'] == queued['payload_file']
+        assert zstd.ZstdDecompressor().decompress(saved_files[0].read_bytes()) == sample_webhook_body
+        
     def test_process_webhook_merge_to_main(self, processor: WebhookProcessor, sample_webhook_payload):
         """Test processing a webhook payload for a merge to main"""
         # Process the webhook
@@ -38,4 +175,220 @@ class TestWebhookProcessor:
         
         # Clean up the saved file
         if result['file_path']:
-            Path(result['file_path']).unlink()
\ No newline at end of file
+            Path(result['file_path']).unlink()
+
+    @pytest.fixture
+    def fake_supabase(self, monkeypatch) -> FakeSupabaseClient:
+        """Route Supabase writes to an in-memory fake"""
+        client = FakeSupabaseClient()
+        monkeypatch.setattr(webhook_processor, '_get_supabase_client', lambda: client)
+        return client
+        
+    @staticmethod
+    def make_result(pr_number: int) -> dict:
+        """Build a process_webhook result for a PR touching one model"""
+        return {
+            'file_path': None,
+            'summary': f'Summary {pr_number}',
+            'pr_data': {'pr_number': pr_number, 'html_url': f'https://github.com/o/r/pull/{pr_number}'},
+            'sql_model_files': [f'models/model_{pr_number}.sql'],
+        }
+        
+    @staticmethod
+    def pr_numbers(rpc_call) -> list:
+        """PR numbers carried by one recorded RPC call, in write order"""
+        return [pr['pr_number'] for pr in rpc_call[1]['pr']]
+        
+    def test_unbatched_callers_write_their_own_rows(self, fake_supabase: FakeSupabaseClient):
+        """Test that concurrent callers without batching each write, and fail on, only their own rows"""
+        fake_supabase.failing_prs.add(1)
+        processor = WebhookProcessor(development_mode=True)
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(processor._save_to_database, self.make_result(1))
+            second = executor.submit(processor._save_to_database, self.make_result(2))
+            with pytest.raises(APIError):
+                first.result()
+            second.result()
+            
+        assert sorted(self.pr_numbers(call) for call in fake_supabase.rpc_calls) == [[1], [2]]
+        assert processor._flush_timer is None
+        
+    def test_batch_flushes_when_full(self, fake_supabase: FakeSupabaseClient):
+        """Test that concurrent PR merges are written in one RPC once the batch is full"""
+        processor = WebhookProcessor(development_mode=True, batch_size=3, flush_interval_s=60)
+        
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [executor.submit(processor._save_to_database, self.make_result(n)) for n in (1, 2, 3)]
+            for future in futures:
+                future.result(timeout=5)
+                
+        assert len(fake_supabase.rpc_calls) == 1
+        name, params = fake_supabase.rpc_calls[0]
+        assert name == 'insert_pr_merge_with_models'
+        assert sorted(self.pr_numbers(fake_supabase.rpc_calls[0])) == [1, 2, 3]
+        assert sorted(m['dbt_model_name'] for m in params['models']) == [
+            'models/model_1.sql', 'models/model_2.sql', 'models/model_3.sql'
+        ]
+        
+        # The timer started for the first row is cancelled by the flush
+        assert processor._flush_timer is None
+        
+    def test_batch_failure_raises_in_every_caller(self, fake_supabase: FakeSupabaseClient):
+        """Test that every caller whose rows were in a failed write gets the error"""
+        fake_supabase.failing_prs.add(1)
+        processor = WebhookProcessor(development_mode=True, batch_size=2, flush_interval_s=60)
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(processor._save_to_database, self.make_result(n)) for n in (1, 2)]
+            for future in futures:
+                with pytest.raises(APIError):
+                    future.result(timeout=5)
+                    
+        assert len(fake_supabase.rpc_calls) == 1
+        
+    def test_batch_flushes_on_timer(self, fake_supabase: FakeSupabaseClient):
+        """Test that a partial batch is written once the flush interval passes"""
+        processor = WebhookProcessor(development_mode=True, batch_size=10, flush_interval_s=0.05)
+        
+        # Blocks until the timer thread has written the row
+        processor._save_to_database(self.make_result(1))
+        
+        assert len(fake_supabase.rpc_calls) == 1
+        assert self.pr_numbers(fake_supabase.rpc_calls[0]) == [1]
+        
+    def test_flush_swaps_buffer(self, fake_supabase: FakeSupabaseClient):
+        """Test that flush writes each buffered row once and leaves an empty buffer"""
+        processor = WebhookProcessor(development_mode=True, batch_size=10, flush_interval_s=60)
+        
+        for pr_number in (1, 2):
+            caller = threading.Thread(target=processor._save_to_database, args=(self.make_result(pr_number),))
+            caller.start()
+            
+            # Wait for the row to be buffered, then flush it for the blocked caller
+            deadline = time.monotonic() + 5
+            while not processor._pending['github_pr_merge'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            processor.flush()
+            caller.join(timeout=5)
+            assert not caller.is_alive()
+            
+        # Nothing left to write
+        processor.flush()
+        assert [self.pr_numbers(call) for call in fake_supabase.rpc_calls] == [[1], [2]]
+        assert not processor._pending['github_pr_merge']
+
+
+class FakeQueueOutput:
+    """Stands in for the github_webhook queue output binding"""
+    def __init__(self):
+        self.messages = []
+        
+    def set(self, val):
+        self.messages.append(val)
+        
+    def get(self):
+        return self.messages[-1]
+
+
+class TestGithubWebhook:
+    @pytest.fixture(autouse=True)
+    def clear_delivery_cache(self):
+        """Start every test with no remembered deliveries"""
+        function_app.delivery_cache.clear()
+        yield
+        function_app.delivery_cache.clear()
+        
+    @staticmethod
+    def make_request(body: bytes, delivery_id: str) -> func.HttpRequest:
+        """Build a GitHub webhook request"""
+        return func.HttpRequest(
+            method='POST',
+            url='/api/github-webhook',
+            headers={'X-GitHub-Delivery': delivery_id},
+            body=body
+        )
+        
+    def test_repeated_ignored_delivery_is_answered_from_cache(self, monkeypatch):
+        """Test that a redelivered non-merge event is not parsed or queued again"""
+        body = json.dumps({'action': 'opened', 'pull_request': {'merged': False, 'base': {'ref': 'main'}}}).encode()
+        calls = []
+        encode = function_app.webhook_processor.encode_queue_message
+        
+        def counting_encode(raw_body, delivery_id=None):
+            calls.append(raw_body)
+            return encode(raw_body, delivery_id=delivery_id)
+        monkeypatch.setattr(function_app.webhook_processor, 'encode_queue_message', counting_encode)
+        
+        first_msg, second_msg = FakeQueueOutput(), FakeQueueOutput()
+        first = function_app.github_webhook(self.make_request(body, 'delivery-1'), first_msg)
+        second = function_app.github_webhook(self.make_request(body, 'delivery-1'), second_msg)
+        
+        assert first.status_code == second.status_code == 200
+        assert first.get_body() == second.get_body()
+        assert len(calls) == 1
+        assert first_msg.messages == second_msg.messages == []
+        
+    @pytest.fixture
+    def merge_body(self) -> bytes:
+        """Raw body of the sample merge-to-main webhook"""
+        return Path("webhooks/webhook_payload_20251002_175804.json").read_bytes()
+        
+    @pytest.fixture
+    def processed_messages(self, monkeypatch) -> list:
+        """Record queue messages handed to the processor instead of processing them"""
+        processed = []
+        monkeypatch.setattr(function_app.webhook_processor, 'process_queue_message', processed.append)
+        return processed
+        
+    def queue(self, body: bytes, delivery_id: str) -> func.QueueMessage:
+        """Run intake for a delivery and return the queue message it produced"""
+        output = FakeQueueOutput()
+        response = function_app.github_webhook(self.make_request(body, delivery_id), output)
+        assert response.status_code == 202
+        return func.QueueMessage(id=delivery_id, body=output.get().encode())
+        
+    def test_accepted_delivery_is_not_cached(self, merge_body):
+        """Test that a redelivered merge is queued again in case the first enqueue failed"""
+        body = merge_body
+        
+        first_msg, second_msg = FakeQueueOutput(), FakeQueueOutput()
+        first = function_app.github_webhook(self.make_request(body, 'delivery-2'), first_msg)
+        second = function_app.github_webhook(self.make_request(body, 'delivery-2'), second_msg)
+        
+        assert first.status_code == second.status_code == 202
+        assert len(first_msg.messages) == len(second_msg.messages) == 1
+        assert 'delivery-2' not in function_app.delivery_cache
+        
+        # The queued message keeps only what processing needs
+        message = json.loads(first_msg.get())
+        assert message['event']['pull_request']['number'] > 0
+        assert message['event']['repository']['owner']['login']
+        assert message['payload_file'] is None
+        assert message['delivery_id'] == 'delivery-2'
+        assert len(first_msg.get()) < len(body)
+        
+    def test_processed_delivery_is_not_processed_again(self, merge_body, processed_messages):
+        """Test that a merge queued twice is processed once and later redeliveries are not queued"""
+        first, second = self.queue(merge_body, 'delivery-3'), self.queue(merge_body, 'delivery-3')
+        
+        function_app.process_github_webhook(first)
+        function_app.process_github_webhook(second)
+        assert len(processed_messages) == 1
+        
+        # Redeliveries after processing are answered at intake
+        output = FakeQueueOutput()
+        response = function_app.github_webhook(self.make_request(merge_body, 'delivery-3'), output)
+        assert response.status_code == 200
+        assert output.messages == []
+        
+    def test_failed_delivery_is_processed_again(self, merge_body, monkeypatch):
+        """Test that a delivery is only recorded once processing succeeds"""
+        def fail(message):
+            raise RuntimeError('Supabase unavailable')
+        monkeypatch.setattr(function_app.webhook_processor, 'process_queue_message', fail)
+        
+        message = self.queue(merge_body, 'delivery-4')
+        with pytest.raises(RuntimeError):
+            function_app.process_github_webhook(message)
+        assert 'delivery-4' not in function_app.delivery_cache
@@ -1,17 +1,119 @@
-import json
+import atexit
+import hashlib
 import logging
 import os
-from datetime import datetime, timezone
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cache, cached_property
+from operator import attrgetter, itemgetter
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 
+import msgspec
+import orjson
 import requests
-from dataclasses import dataclass
-from openai import OpenAI
-from supabase import create_client, Client
+from cachetools import LRUCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-@dataclass
-class PullRequestData:
+# The OpenAI, Supabase, httpx and zstandard packages are imported where they are
+# first used so cold starts that never need them skip the import cost
+if TYPE_CHECKING:
+    import httpx
+    import zstandard
+    from openai import OpenAI
+    from supabase import Client
+
+# Environment settings, read once at import (Function App settings are fixed per process)
+_CONFIG = SimpleNamespace(
+    openai_api_key=os.getenv('OPENAI_API_KEY'),
+    supabase_url=os.getenv('SUPABASE_URL'),
+    supabase_key=os.getenv('SUPABASE_KEY'),
+    github_token=os.getenv('GITHUB_TOKEN')
+)
+
+# Last (second, formatted UTC timestamp) pair from WebhookProcessor.get_utc_timestamp
+_utc_timestamp_cache = (0, '')
+
+# Base branches whose merges are tracked
+_MAIN_BRANCHES = frozenset({'main', 'master'})
+
+# Field getters for the fixed GitHub PR webhook schema
+_get_pr_core = itemgetter('number', 'title', 'body', 'url', 'created_at', 'html_url')
+_get_user = itemgetter('user')
+_get_owner = itemgetter('owner')
+
+# Invariant system prompt; an identical prefix lets OpenAI reuse its prompt cache
+_SYSTEM_MSG = {"role": "system", "content": "You are a technical writer who creates concise PR summaries for release notes."}
+_USER_PROMPT_TEMPLATE = (
+    "Generate a 1-2 line summary of this pull request. Focus on the main changes and impact.\n\n"
+    "Title: {title}\n"
+    "Description: {description}\n\n"
+    "Respond with ONLY the summary, no additional text or formatting."
+)
+
+# PR description cleanup before it is sent to OpenAI; a 1-2 line summary
+# doesn't need template boilerplate, link targets or the full body
+_MAX_DESCRIPTION_CHARS = 2000
+_HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+_MARKDOWN_LINK_RE = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+_CHECKLIST_ITEM_RE = re.compile(r'^[ \t]*[-*] \[[ xX]\].*(?:\n|$)', re.M)
+_EXTRA_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+def _clean_description(description: str) -> str:
+    """Strip PR template noise from a description and truncate it."""
+    description = _HTML_COMMENT_RE.sub('', description)
+    description = _MARKDOWN_LINK_RE.sub(r'\1', description)
+    description = _CHECKLIST_ITEM_RE.sub('', description)
+    description = _EXTRA_BLANK_LINES_RE.sub('\n\n', description)
+    return description.strip()[:_MAX_DESCRIPTION_CHARS]
+
+class _BaseRef(msgspec.Struct):
+    ref: str = ''
+
+class _Account(msgspec.Struct):
+    login: Optional[str] = None
+
+class _PullRequestEvent(msgspec.Struct):
+    merged: Optional[bool] = None
+    base: Optional[_BaseRef] = None
+    number: Optional[int] = None
+    title: Optional[str] = None
+    body: Optional[str] = None
+    url: Optional[str] = None
+    created_at: Optional[str] = None
+    html_url: Optional[str] = None
+    user: Optional[_Account] = None
+
+class _RepositoryEvent(msgspec.Struct):
+    name: Optional[str] = None
+    owner: Optional[_Account] = None
+
+class _WebhookEvent(msgspec.Struct):
+    """Subset of a GitHub webhook payload needed for the merge-to-main check and processing"""
+    action: Optional[str] = None
+    pull_request: Optional[_PullRequestEvent] = None
+    repository: Optional[_RepositoryEvent] = None
+
+_WEBHOOK_EVENT_DECODER = msgspec.json.Decoder(_WebhookEvent)
+
+class _QueueMessage(msgspec.Struct):
+    """Message handed from webhook intake to the queue trigger"""
+    event: _WebhookEvent
+    # Where intake saved the full webhook body, when save_payload is enabled
+    payload_file: Optional[str] = None
+    # X-GitHub-Delivery id, so redeliveries of a processed merge can be skipped
+    delivery_id: Optional[str] = None
+
+# PullRequestData fields stored in the github_pr_merge table
+_PR_FIELDS = ('pr_number', 'title', 'creator', 'created_at', 'html_url', 'repo_owner', 'repo_name')
+_get_pr_fields = attrgetter(*_PR_FIELDS)
+
+class PullRequestData(msgspec.Struct, frozen=True):
     """Data class to hold relevant PR information"""
     pr_number: int
     title: str
@@ -23,50 +125,169 @@ class PullRequestData:
     repo_owner: str
     repo_name: str
 
+# Clients are created once per worker process and shared by every processor
+# instance, so warm Azure Functions invocations skip client setup entirely
+
+@cache
+def _get_http_client() -> 'httpx.Client':
+    import httpx
+    
+    # One keep-alive connection pool for both OpenAI and Supabase traffic
+    return httpx.Client(
+        http2=True,
+        timeout=httpx.Timeout(30.0),
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+    )
+
+@cache
+def _get_openai_client() -> Optional['OpenAI']:
+    openai_api_key = _CONFIG.openai_api_key
+    if not openai_api_key:
+        logging.warning("OPENAI_API_KEY not found in environment variables")
+        return None
+    
+    import httpx
+    from openai import OpenAI
+    
+    # Fail fast on connect and let the SDK retry, rather than hanging on one attempt
+    return OpenAI(
+        api_key=openai_api_key,
+        http_client=_get_http_client(),
+        timeout=httpx.Timeout(10.0, connect=1.0),
+        max_retries=3
+    )
+
+@cache
+def _get_supabase_client() -> Optional['Client']:
+    supabase_url = _CONFIG.supabase_url
+    supabase_key = _CONFIG.supabase_key
+    if not supabase_url or not supabase_key:
+        logging.warning("SUPABASE_URL or SUPABASE_KEY not found in environment variables")
+        return None
+    
+    from supabase import create_client, ClientOptions, SupabaseException
+    try:
+        return create_client(supabase_url, supabase_key, options=ClientOptions(httpx_client=_get_http_client()))
+    except SupabaseException:
+        logging.exception("Failed to initialize Supabase client")
+        return None
+
+@cache
+def _get_github_session(github_token: Optional[str], github_api_base: str) -> requests.Session:
+    session = requests.Session()
+    session.headers.update({
+        'Authorization': f'Bearer {github_token}',
+        'Accept': 'application/vnd.github.v3+json',
+        'X-GitHub-Api-Version': '2022-11-28'
+    })
+    session.mount(github_api_base, HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    ))
+    return session
+
+def close_shared_clients() -> None:
+    """
+    Close the process-wide HTTP connection pools (call on shutdown).
+    
+    The factory caches are cleared too, so a processor used afterwards gets
+    fresh clients rather than ones bound to a closed pool.
+    """
+    if _get_http_client.cache_info().currsize:
+        _get_http_client().close()
+    # Dropped GitHub sessions release their connections when garbage collected
+    for factory in (_get_http_client, _get_openai_client, _get_supabase_client, _get_github_session):
+        factory.cache_clear()
+
 class WebhookProcessor:
-    def __init__(self, development_mode: bool = False, save_payload: bool = False):
+    def __init__(
+        self,
+        development_mode: bool = False,
+        save_payload: bool = False,
+        pretty_print: bool = False,
+        batch_size: int = 1,
+        flush_interval_s: float = 5.0
+    ):
         """
         Initialize the webhook processor.
         
         Args:
             development_mode (bool): If True, enables local file processing mode
             save_payload (bool): If True, saves webhook payloads to file (default False)
+            pretty_print (bool): If True, saved payloads are re-serialized with 2-space
+                indentation for reading; otherwise the compact body is written as-is (default False)
+            batch_size (int): Number of PR merges from concurrent callers to write to
+                Supabase in one call (default 1, i.e. each webhook writes its own rows).
+                A batching caller blocks until the write carrying its rows finishes and
+                gets that write's error, so one bad row fails the whole batch
+            flush_interval_s (float): Maximum seconds a buffered PR merge waits
+                before it is written (default 5.0)
         """
         self.development_mode = development_mode
         self.save_payload = save_payload
+        self.pretty_print = pretty_print
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._pending: Dict[str, List[Dict]] = defaultdict(list)
+        # Resolved once the buffered rows are written, so callers can wait on their batch
+        self._pending_written: Future = Future()
+        self._pending_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._summary_cache = LRUCache(maxsize=1024)
+        self._summary_cache_lock = threading.Lock()
         self.webhooks_dir = Path('webhooks')
-        self.webhooks_dir.mkdir(exist_ok=True)
+        self._webhook_prefix = str(self.webhooks_dir / 'webhook_payload_')
+        self._webhooks_dir_created = False
         
-        # Initialize OpenAI client
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-        if not openai_api_key:
-            logging.warning("OPENAI_API_KEY not found in environment variables")
-        self.openai_client = OpenAI(api_key=openai_api_key) if openai_api_key else None
-        
-        # Initialize Supabase client
-        supabase_url = os.environ.get('SUPABASE_URL')
-        supabase_key = os.environ.get('SUPABASE_KEY')
-        if not supabase_url or not supabase_key:
-            logging.warning("SUPABASE_URL or SUPABASE_KEY not found in environment variables")
-            self.supabase_client = None
-        else:
-            try:
-                self.supabase_client: Optional[Client] = create_client(supabase_url, supabase_key)
-            except Exception as e:
-                logging.error(f"Failed to initialize Supabase client: {str(e)}")
-                self.supabase_client = None
-        
-        # Initialize GitHub API client
-        github_token = os.environ.get('GITHUB_TOKEN')
+        # GitHub API settings; the OpenAI, Supabase and GitHub clients are built
+        # lazily on first use so events that skip processing never pay for them
+        github_token = _CONFIG.github_token
         if not github_token:
             logging.warning("GITHUB_TOKEN not found in environment variables")
         self.github_token = github_token
         self.github_api_base = "https://api.github.com"
 
+    @property
+    def openai_client(self) -> Optional['OpenAI']:
+        """OpenAI client, or None if OPENAI_API_KEY is not set."""
+        return _get_openai_client()
+
+    @property
+    def supabase_client(self) -> Optional['Client']:
+        """Supabase client, or None if it is not configured or fails to initialize."""
+        return _get_supabase_client()
+
+    @property
+    def _gh_session(self) -> requests.Session:
+        """Pooled GitHub API session so warm instances skip the TCP/TLS handshake."""
+        return _get_github_session(self.github_token, self.github_api_base)
+
+    @cached_property
+    def _has_work(self) -> bool:
+        """Whether anything consumes process_webhook's output, resolved once per processor."""
+        # Development mode returns the result to the caller for inspection. Checks the
+        # settings rather than the clients so non-merge events never build them
+        has_work = bool(
+            self.development_mode
+            or self.save_payload
+            or _CONFIG.openai_api_key
+            or (_CONFIG.supabase_url and _CONFIG.supabase_key)
+        )
+        if not has_work:
+            logging.warning("No OpenAI, Supabase or payload saving configured - webhooks will not be processed")
+        return has_work
+
     @staticmethod
     def get_utc_timestamp() -> str:
-        """Get current UTC timestamp in YYYYMMDD_HHMMSS format."""
-        return datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+        """Get current UTC timestamp in YYYYMMDD_HHMMSS format, formatted at most once per second."""
+        global _utc_timestamp_cache
+        now = int(time.time())
+        last_second, timestamp = _utc_timestamp_cache
+        if now != last_second:
+            timestamp = time.strftime('%Y%m%d_%H%M%S', time.gmtime(now))
+            _utc_timestamp_cache = (now, timestamp)
+        return timestamp
 
     def generate_pr_summary(self, pr_data: PullRequestData) -> Optional[str]:
         """
@@ -82,115 +303,88 @@ class WebhookProcessor:
             logging.error("OpenAI client not initialized - cannot generate summary")
             return None
             
+        # Duplicate deliveries and replays of the same PR reuse the earlier summary
+        cache_key = hashlib.blake2b(
+            f'{pr_data.title}\x00{pr_data.description}'.encode(), digest_size=16
+        ).digest()
+        with self._summary_cache_lock:
+            cached_summary = self._summary_cache.get(cache_key)
+        if cached_summary is not None:
+            logging.info('Reusing cached summary for PR #%s', pr_data.pr_number)
+            return cached_summary
+            
+        import openai
         try:
             # Prepare the prompt
-            prompt = f"""Generate a 1-2 line summary of this pull request. Focus on the main changes and impact.
-            
-            Title: {pr_data.title}
-            Description: {pr_data.description}
-            
-            Respond with ONLY the summary, no additional text or formatting."""
+            prompt = _USER_PROMPT_TEMPLATE.format(
+                title=pr_data.title,
+                description=_clean_description(pr_data.description)
+            )
             
             # Call OpenAI API
             response = self.openai_client.chat.completions.create(
                 model="gpt-4.1-nano",
-                messages=[
-                    {"role": "system", "content": "You are a technical writer who creates concise PR summaries for release notes."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=[_SYSTEM_MSG, {"role": "user", "content": prompt}],
                 temperature=0.7,
-                max_tokens=100
+                max_tokens=60,
+                stream=True
             )
             
-            # Extract and return the summary
-            if response.choices and response.choices[0].message.content:
-                return response.choices[0].message.content.strip()
-            return None
+            # Collect the streamed tokens and return the summary
+            parts = []
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+            summary = ''.join(parts).strip()
+            if not summary:
+                return None
+                
+            with self._summary_cache_lock:
+                self._summary_cache[cache_key] = summary
+            logging.info('Generated summary for PR #%s: %s', pr_data.pr_number, summary)
+            return summary
             
-        except Exception as e:
-            logging.error(f"Error generating PR summary: {str(e)}")
+        except openai.APIError:
+            logging.exception("Error generating PR summary")
             return None
 
-    def save_to_supabase(self, table_name: str, data: Union[Dict, List[Dict]]) -> bool:
-        """Save data to a specified Supabase table (supports single record or batch)."""
-        if not self.supabase_client:
-            logging.warning("Supabase client not initialized - cannot save to database")
-            return False
-            
-        if not data:
-            logging.warning("No data provided to save to database")
-            return False
-            
-        try:
-            response = self.supabase_client.table(table_name).insert(data).execute()
-            
-            if response.data:
-                record_count = len(response.data) if isinstance(response.data, list) else 1
-                logging.info(f"Successfully saved {record_count} record(s) to {table_name} table")
-                return True
-            else:
-                logging.error(f"Failed to save to {table_name} table - no data returned")
-                return False
-                
-        except Exception as e:
-            logging.error(f"Error saving to {table_name} table in Supabase: {str(e)}")
-            return False
-
-    def _build_pr_data_dict(self, pr_data: PullRequestData) -> Dict:
-        """Build a dictionary from PullRequestData object."""
-        return {
-            'pr_number': pr_data.pr_number,
-            'title': pr_data.title,
-            'creator': pr_data.creator,
-            'created_at': pr_data.created_at,
-            'html_url': pr_data.html_url,
-            'repo_owner': pr_data.repo_owner,
-            'repo_name': pr_data.repo_name
-        }
-    
-    def _build_dbt_model_changes_dict(self, model_filename: str, pr_data: Dict, summary: Optional[str]) -> Dict:
-        """Build a dictionary for dbt model changes table."""
-        return {
-            'dbt_model_name': model_filename,
-            'pr_html_url': pr_data.get('html_url'),
-            'ai_summary': summary,
-            'pr_created_at': pr_data.get('created_at'),
-            'pr_creator': pr_data.get('creator'),
-        }
-
     def _prepare_pr_merge_data(self, result_data: Dict) -> Optional[Dict]:
         """Prepare data for github_pr_merge table."""
         pr_data = result_data.get('pr_data')
         if not pr_data:
             return None
             
-        return {
-            **pr_data,
-            'summary': result_data.get('summary'),
-            'file_path': result_data.get('file_path')
-        }
+        # pr_data was built for this result alone, so extend it in place rather than copying it
+        pr_data['summary'] = result_data.get('summary')
+        pr_data['file_path'] = result_data.get('file_path')
+        return pr_data
 
     def extract_pr_data(self, payload: Dict) -> Optional[PullRequestData]:
         """Extract relevant PR information from the webhook payload."""
+        pr = payload.get('pull_request')
+        if not pr:
+            return None
+        return self._build_pr_data(pr, payload.get('repository'))
+
+    def _build_pr_data(self, pr: Dict, repository: Optional[Dict]) -> Optional[PullRequestData]:
+        """Build PullRequestData from the pull_request and repository objects of a payload."""
+        # GitHub's PR webhook schema is fixed, so index directly instead of
+        # chaining .get() calls with default dicts
         try:
-            pr = payload.get('pull_request', {})
-            repository = payload.get('repository', {})
-            if not pr:
-                return None
-                
+            pr_number, title, body, url, created_at, html_url = _get_pr_core(pr)
             return PullRequestData(
-                pr_number=pr.get('number'),
-                title=pr.get('title', ''),
-                description=pr.get('body') or '',
-                url=pr.get('url', ''),
-                creator=pr.get('user', {}).get('login', ''),
-                created_at=pr.get('created_at', ''),
-                html_url=pr.get('html_url', ''),
-                repo_owner=repository.get('owner', {}).get('login', ''),
-                repo_name=repository.get('name', '')
+                pr_number=pr_number,
+                title=title or '',
+                description=body or '',
+                url=url or '',
+                creator=_get_user(pr)['login'],
+                created_at=created_at or '',
+                html_url=html_url or '',
+                repo_owner=_get_owner(repository)['login'],
+                repo_name=repository['name']
             )
-        except Exception as e:
-            logging.error(f"Error extracting PR data: {str(e)}")
+        except (KeyError, TypeError) as e:
+            logging.error("Error extracting PR data - malformed payload: %s", e)
             return None
 
     def fetch_pr_files(self, repo_owner: str, repo_name: str, pr_number: int) -> Optional[List[Dict]]:
@@ -201,82 +395,181 @@ class WebhookProcessor:
             
         try:
             url = f"{self.github_api_base}/repos/{repo_owner}/{repo_name}/pulls/{pr_number}/files"
-            headers = {
-                'Authorization': f'Bearer {self.github_token}',
-                'Accept': 'application/vnd.github.v3+json',
-                'X-GitHub-Api-Version': '2022-11-28'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30)
+            response = self._gh_session.get(url, timeout=30)
             response.raise_for_status()
             
             files = response.json()
-            logging.info(f"Successfully fetched {len(files)} files for PR #{pr_number}")
+            logging.info("Successfully fetched %d files for PR #%s", len(files), pr_number)
             return files
             
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error fetching PR files from GitHub API: {str(e)}")
-            return None
-        except Exception as e:
-            logging.error(f"Unexpected error fetching PR files: {str(e)}")
+        except requests.exceptions.RequestException:
+            logging.exception("Error fetching PR files from GitHub API")
             return None
 
     def filter_sql_model_files(self, files: List[Dict]) -> List[str]:
         """Filter files to get only models/*.sql filenames."""
-        sql_model_files = [
-            file.get('filename', '') 
-            for file in files 
-            if file.get('filename', '').startswith('models/') and file.get('filename', '').endswith('.sql')
-        ]
+        sql_model_files = []
+        append = sql_model_files.append
+        for file in files:
+            filename = file.get('filename')
+            if filename is not None and filename.startswith('models/') and filename.endswith('.sql'):
+                append(filename)
         
         if sql_model_files:
-            logging.info(f"Found {len(sql_model_files)} SQL model files: {sql_model_files}")
+            logging.info("Found %d SQL model files: %s", len(sql_model_files), sql_model_files)
         else:
             logging.info("No SQL model files found in this PR")
             
         return sql_model_files
 
-    def process_webhook(self, payload: Dict) -> Optional[Dict]:
-        """Process a webhook payload for PR merges to main/master branch."""
-        # Check if this is a merge into main/master branch
-        base_branch = payload.get('pull_request', {}).get('base', {}).get('ref', '')
-        is_merge_to_main = (
-            payload.get('action') == 'closed' and
-            payload.get('pull_request', {}).get('merged') is True and
-            base_branch in ['main', 'master']
-        )
+    def is_merge_to_main(self, payload: Dict) -> bool:
+        """Check whether the webhook payload is a PR merge into main/master."""
+        # Most events aren't closes, so skip the pull_request lookups for them
+        action = payload.get('action')
+        if action != 'closed':
+            return self._check_merge_to_main(action, None, '')
+            
+        pr = payload.get('pull_request') or {}
+        return self._check_merge_to_main(action, pr.get('merged'), (pr.get('base') or {}).get('ref', ''))
+
+    def encode_queue_message(self, body: bytes, delivery_id: Optional[str] = None) -> Optional[bytes]:
+        """
+        Re-encode a merge-to-main webhook body as a compact queue message.
+
+        Only the fields process_webhook reads are kept, in the same shape as the
+        GitHub payload, and the PR description is cleaned and truncated the way
+        the summary prompt uses it. This keeps messages well under the storage
+        queue size limit regardless of how long the PR body is. As the full body
+        is only available here, it is saved here when save_payload is enabled.
+
+        Args:
+            body (bytes): The raw webhook request body
+            delivery_id (Optional[str]): The X-GitHub-Delivery header, carried along
+                so the queue trigger can skip deliveries it already processed
+
+        Returns:
+            The encoded message, or None if the event is not a merge to main/master
+
+        Raises:
+            ValueError: If the body is not valid JSON or has unexpected field types
+        """
+        event = self._decode_webhook_event(body)
+        if not self._is_merge_event(event):
+            return None
+
+        payload_file = self.save_webhook_payload(self._payload_to_save(body)) if self.save_payload else None
+        
+        pr = event.pull_request
+        pr.body = _clean_description(pr.body or '')
+        return msgspec.json.encode(_QueueMessage(event=event, payload_file=payload_file, delivery_id=delivery_id))
+
+    @staticmethod
+    def _decode_webhook_event(body: bytes) -> _WebhookEvent:
+        """Decode only the fields processing needs; the parser skips the rest of the payload."""
+        try:
+            return _WEBHOOK_EVENT_DECODER.decode(body)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    def _is_merge_event(self, event: _WebhookEvent) -> bool:
+        pr = event.pull_request
+        if pr is None:
+            return self._check_merge_to_main(event.action, None, '')
+        return self._check_merge_to_main(event.action, pr.merged, pr.base.ref if pr.base else '')
+
+    def _check_merge_to_main(self, action: Optional[str], merged: Optional[bool], base_branch: str) -> bool:
+        """Apply the merge-to-main rules, logging why an event is skipped."""
+        # Cheapest checks first so non-merge events bail out early
+        if action != 'closed':
+            logging.info('Not a closed PR event (got %s) - skipping processing', action)
+            return False
+            
+        if merged is not True:
+            logging.info('PR closed without merging - skipping processing')
+            return False
+            
+        if base_branch not in _MAIN_BRANCHES:
+            logging.info('Not a merge to main/master (got %s) - skipping processing', base_branch)
+            return False
+            
+        return True
+
+    def process_webhook(self, payload: Dict, raw_body: Optional[bytes] = None) -> Optional[Dict]:
+        """
+        Process a webhook payload for PR merges to main/master branch.
+        
+        Args:
+            payload (Dict): The parsed webhook payload
+            raw_body (Optional[bytes]): The original request body, saved as-is when
+                save_payload is enabled to avoid re-serializing the payload
+        """
+        return self._process_webhook(payload, raw_body, None, self.save_payload)
+
+    def process_queue_message(self, message: Dict) -> Optional[Dict]:
+        """
+        Process a parsed message queued by encode_queue_message.
         
-        if not is_merge_to_main:
-            logging.info(f'Not a merge to main/master (got {base_branch}) - skipping processing')
+        The message only carries a subset of the webhook, so it is never saved;
+        the file intake saved the full body to is recorded instead.
+        """
+        return self._process_webhook(message['event'], None, message.get('payload_file'), False)
+
+    def _payload_to_save(self, raw_body: Optional[bytes], payload: Optional[Dict] = None) -> bytes:
+        """Bytes to save for a payload, honouring pretty_print."""
+        if self.pretty_print:
+            return orjson.dumps(payload if payload is not None else orjson.loads(raw_body), option=orjson.OPT_INDENT_2)
+        if raw_body is None:
+            return orjson.dumps(payload)
+        return raw_body
+
+    def _process_webhook(
+        self,
+        payload: Dict,
+        raw_body: Optional[bytes],
+        payload_file: Optional[str],
+        save_payload: bool
+    ) -> Optional[Dict]:
+        """Run the pipeline, either saving the payload or recording where it was saved."""
+        if not self._has_work:
             return None
             
-        # Extract and process PR data
-        pr_data = self.extract_pr_data(payload)
+        if not self.is_merge_to_main(payload):
+            return None
+            
+        # The merge check already proved pull_request is present, so build from it directly
+        pr_data = self._build_pr_data(payload['pull_request'], payload.get('repository'))
         if not pr_data:
             return None
             
         result = {
-            'file_path': None,
+            'file_path': payload_file,
             'summary': None,
-            'pr_data': self._build_pr_data_dict(pr_data),
+            'pr_data': dict(zip(_PR_FIELDS, _get_pr_fields(pr_data))),
             'sql_model_files': [],
         }
         
-        # Fetch and filter SQL model files
-        pr_files = self.fetch_pr_files(pr_data.repo_owner, pr_data.repo_name, pr_data.pr_number)
-        if pr_files:
-            result['sql_model_files'] = self.filter_sql_model_files(pr_files)
+        # Start the payload write so it overlaps the API calls below
+        if save_payload:
+            payload_write = self._submit_payload_write(self._payload_to_save(raw_body, payload))
         
-        # Generate AI summary if available
-        if self.openai_client:
-            summary = self.generate_pr_summary(pr_data)
-            if summary:
-                result['summary'] = summary
-                logging.info(f'Generated summary for PR #{pr_data.pr_number}: {summary}')
+        # The GitHub file fetch and the AI summary are independent, so overlap them
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            summary_future = executor.submit(self.generate_pr_summary, pr_data) if self.openai_client else None
+            
+            # Fetch and filter SQL model files
+            pr_files = self.fetch_pr_files(pr_data.repo_owner, pr_data.repo_name, pr_data.pr_number)
+            if pr_files:
+                result['sql_model_files'] = self.filter_sql_model_files(pr_files)
+            
+            # Collect AI summary if available
+            if summary_future:
+                summary = summary_future.result()
+                if summary:
+                    result['summary'] = summary
         
-        # Save payload if enabled
-        if self.save_payload:
-            result['file_path'] = self.save_webhook_payload(payload)
+        # Only record the payload file once it has actually been written
+        if save_payload:
+            result['file_path'] = payload_write.result()
         
         # Save to database
         self._save_to_database(result)
@@ -289,36 +582,152 @@ class WebhookProcessor:
             logging.info('Supabase client not available - skipping database save')
             return
             
-        # Save PR merge data
         pr_merge_data = self._prepare_pr_merge_data(result)
-        if pr_merge_data:
-            self.save_to_supabase('github_pr_merge', pr_merge_data)
-
-        # Save model changes in batch (more efficient than row-by-row)
-        if result['sql_model_files']:
-            model_changes_batch = [
-                self._build_dbt_model_changes_dict(
-                    sql_model_file, 
-                    result['pr_data'], 
-                    result.get('summary')
-                )
-                for sql_model_file in result['sql_model_files']
-            ]
-            self.save_to_supabase('dbt_model_changes', model_changes_batch)
-
-    def save_webhook_payload(self, payload: Dict) -> str:
-        """Save the webhook payload to a JSON file."""
-        timestamp = self.get_utc_timestamp()
-        filename = f'webhook_payload_{timestamp}.json'
-        file_path = self.webhooks_dir / filename
+        if not pr_merge_data:
+            return
+            
+        # Values shared by every model change row are looked up once
+        pr_data = result['pr_data']
+        pr_html_url = pr_data.get('html_url')
+        pr_created_at = pr_data.get('created_at')
+        pr_creator = pr_data.get('creator')
+        summary = result.get('summary')
+        model_changes_batch = [
+            {
+                'dbt_model_name': sql_model_file,
+                'pr_html_url': pr_html_url,
+                'ai_summary': summary,
+                'pr_created_at': pr_created_at,
+                'pr_creator': pr_creator,
+            }
+            for sql_model_file in result['sql_model_files']
+        ]
+        
+        # Without batching there is nothing to share a write with, so skip the buffer
+        if self.batch_size <= 1:
+            self._write_rows([pr_merge_data], model_changes_batch)
+            return
+            
+        # Buffer the rows; they are written once the batch fills or the timer fires
+        with self._pending_lock:
+            self._pending['github_pr_merge'].append(pr_merge_data)
+            self._pending['dbt_model_changes'].extend(model_changes_batch)
+            written = self._pending_written
+            batch_full = len(self._pending['github_pr_merge']) >= self.batch_size
+            if not batch_full and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval_s, self._flush_pending)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+                
+        if batch_full:
+            self._flush_pending()
         
-        with open(file_path, 'w') as f:
-            json.dump(payload, f, indent=2)
+        # Wait for whichever flush carried these rows and raise its error, so the
+        # caller (e.g. the queue trigger) only acknowledges rows that were written
+        written.result()
+
+    def flush(self) -> None:
+        """
+        Write all buffered PR merges and model changes to Supabase (call on shutdown).
         
-        return str(file_path)
+        Raises:
+            postgrest.APIError, httpx.HTTPError: If the write fails
+        """
+        written = self._flush_pending()
+        if written is not None:
+            written.result()
+
+    def _flush_pending(self) -> Optional[Future]:
+        """Write the buffered rows, reporting the outcome to their waiters instead of raising."""
+        # Swap the buffer under the lock so producers aren't blocked by the network call
+        with self._pending_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending['github_pr_merge']:
+                return None
+            pending, self._pending = self._pending, defaultdict(list)
+            written, self._pending_written = self._pending_written, Future()
+            
+        try:
+            self._write_rows(pending['github_pr_merge'], pending['dbt_model_changes'])
+        except Exception as e:
+            # Any failure must reach the waiters, or they would block forever
+            written.set_exception(e)
+        else:
+            written.set_result(None)
+        return written
+
+    def _write_rows(self, pr_merges: List[Dict], model_changes: List[Dict]) -> None:
+        """Insert PR merges and their model changes in one round-trip and transaction."""
+        import httpx
+        from postgrest import APIError
+        
+        try:
+            self.supabase_client.rpc(
+                'insert_pr_merge_with_models',
+                {'pr': pr_merges, 'models': model_changes}
+            ).execute()
+            logging.info("Successfully saved %d PR merge(s) and %d model change(s) to Supabase", len(pr_merges), len(model_changes))
+        except (APIError, httpx.HTTPError):
+            logging.exception("Error saving PR merge data to Supabase")
+            raise
+
+    def close(self) -> None:
+        """Flush buffered writes, finish payload file writes and close the shared HTTP connection pools (call on shutdown)."""
+        try:
+            self.flush()
+        finally:
+            close_shared_clients()
+            
+            # Wait for pending payload writes; a later save starts a fresh pool
+            io_pool = self.__dict__.pop('_io_pool', None)
+            if io_pool is not None:
+                io_pool.shutdown(wait=True)
+
+    def save_webhook_payload(self, raw_body: bytes) -> Optional[str]:
+        """Save the raw webhook body to a zstd-compressed JSON file, returning its path or None if the write failed."""
+        return self._submit_payload_write(raw_body).result()
+
+    def _submit_payload_write(self, raw_body: bytes) -> Future:
+        """Start writing a payload file; the future resolves to its path, or None if the write failed."""
+        # Nanosecond and process id suffix keeps payloads saved in the same second,
+        # by any worker process, from colliding
+        timestamp = self.get_utc_timestamp()
+        file_path = f'{self._webhook_prefix}{timestamp}_{time.time_ns() % 1_000_000_000:09d}_{os.getpid()}.json.zst'
+        
+        # Compress and write off the calling thread so callers can overlap other work
+        return self._io_pool.submit(self._write_payload, file_path, raw_body)
+
+    @cached_property
+    def _io_pool(self) -> ThreadPoolExecutor:
+        """Single-thread pool for payload file writes, drained at interpreter exit."""
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='webhook-payload-io')
+        atexit.register(pool.shutdown)
+        return pool
+
+    @cached_property
+    def _zstd(self) -> 'zstandard.ZstdCompressor':
+        """Payload compressor, only used from the single I/O thread as compressors aren't thread safe."""
+        import zstandard
+        return zstandard.ZstdCompressor(level=3)
+
+    def _write_payload(self, file_path: str, raw_body: bytes) -> Optional[str]:
+        """Compress and write a payload file (runs on the I/O pool)."""
+        try:
+            # Create the directory on first save rather than on every processor init
+            if not self._webhooks_dir_created:
+                self.webhooks_dir.mkdir(exist_ok=True)
+                self._webhooks_dir_created = True
+            
+            Path(file_path).write_bytes(self._zstd.compress(raw_body))
+            return file_path
+        except OSError as e:
+            logging.error("Error saving webhook payload to %s: %s", file_path, e)
+            return None
 
     def process_local_file(self, file_path: Union[str, Path]) -> Optional[Dict]:
-        """Process a webhook payload from a local JSON file (development mode only)."""
+        """Process a webhook payload from a local JSON or .json.zst file (development mode only)."""
         if not self.development_mode:
             logging.warning("Attempted to process local file while not in development mode")
             return None
@@ -327,7 +736,8 @@ class WebhookProcessor:
         if not file_path.exists():
             raise FileNotFoundError(f"File not found: {file_path}")
             
-        with open(file_path) as f:
-            payload = json.load(f)
-            
-        return self.process_webhook(payload)
+        raw_body = file_path.read_bytes()
+        if file_path.suffix == '.zst':
+            import zstandard
+            raw_body = zstandard.ZstdDecompressor().decompress(raw_body)
+        return self.process_webhook(orjson.loads(raw_body), raw_body=raw_body)
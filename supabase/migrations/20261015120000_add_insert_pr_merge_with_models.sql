@@ -0,0 +1,30 @@
+-- Insert a PR merge and its dbt model changes in a single call
+-- Lets the webhook backend save both tables in one round-trip and one transaction
+CREATE OR REPLACE FUNCTION public.insert_pr_merge_with_models(pr JSONB, models JSONB DEFAULT '[]'::JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SET search_path = ''
+AS $$
+DECLARE
+    pr_merge_id INTEGER;
+BEGIN
+    INSERT INTO public.github_pr_merge (
+        pr_number, title, creator, created_at, html_url, repo_owner, repo_name, summary, file_path
+    )
+    SELECT r.pr_number, r.title, r.creator, r.created_at, r.html_url, r.repo_owner, r.repo_name, r.summary, r.file_path
+    FROM jsonb_populate_record(NULL::public.github_pr_merge, pr) AS r
+    RETURNING id INTO pr_merge_id;
+
+    INSERT INTO public.dbt_model_changes (
+        dbt_model_name, pr_html_url, ai_summary, pr_created_at, pr_creator
+    )
+    SELECT m.dbt_model_name, m.pr_html_url, m.ai_summary, m.pr_created_at, m.pr_creator
+    FROM jsonb_populate_recordset(NULL::public.dbt_model_changes, COALESCE(models, '[]'::JSONB)) AS m;
+
+    RETURN pr_merge_id;
+END;
+$$;
+
+-- Only the service role (webhook backend) may call it
+REVOKE EXECUTE ON FUNCTION public.insert_pr_merge_with_models(JSONB, JSONB) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.insert_pr_merge_with_models(JSONB, JSONB) TO service_role;
@@ -0,0 +1,30 @@
+-- Let insert_pr_merge_with_models take a single PR merge object or an array of them
+-- so the webhook backend can flush several buffered PR merges in one call
+-- Returns the number of github_pr_merge rows inserted
+CREATE OR REPLACE FUNCTION public.insert_pr_merge_with_models(pr JSONB, models JSONB DEFAULT '[]'::JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SET search_path = ''
+AS $$
+DECLARE
+    pr_merge_count INTEGER;
+BEGIN
+    INSERT INTO public.github_pr_merge (
+        pr_number, title, creator, created_at, html_url, repo_owner, repo_name, summary, file_path
+    )
+    SELECT r.pr_number, r.title, r.creator, r.created_at, r.html_url, r.repo_owner, r.repo_name, r.summary, r.file_path
+    FROM jsonb_populate_recordset(
+        NULL::public.github_pr_merge,
+        CASE WHEN jsonb_typeof(pr) = 'array' THEN pr ELSE jsonb_build_array(pr) END
+    ) AS r;
+    GET DIAGNOSTICS pr_merge_count = ROW_COUNT;
+
+    INSERT INTO public.dbt_model_changes (
+        dbt_model_name, pr_html_url, ai_summary, pr_created_at, pr_creator
+    )
+    SELECT m.dbt_model_name, m.pr_html_url, m.ai_summary, m.pr_created_at, m.pr_creator
+    FROM jsonb_populate_recordset(NULL::public.dbt_model_changes, COALESCE(models, '[]'::JSONB)) AS m;
+
+    RETURN pr_merge_count;
+END;
+$$;